@@ -1,16 +1,25 @@
 import streamlit as st
 import pandas as pd
-import pydeck as pdk
+import numpy as np
 import requests
-import json
-import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import io
-from typing import Optional, List, Dict, Any
-import plotly.express as px
-import plotly.graph_objects as go
+import ast
+import gzip
+import random
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import TYPE_CHECKING, Optional, List, Dict, Any, Tuple
 from datetime import datetime
 import math
 
+# pydeck, plotly and pyarrow are imported inside the map builders, chart builders
+# and CSV writer, so startup doesn't load them
+if TYPE_CHECKING:
+    import plotly.graph_objects as go
+    import pydeck as pdk
+
 # ====================
 # 1. PAGE CONFIG
 # ====================
@@ -30,6 +39,24 @@ st.set_page_config(
 # ====================
 APIFY_API_URL = "https://api.apify.com/v2/acts/powerai~google-map-nearby-search-scraper/run-sync-get-dataset-items"
 APIFY_TOKEN = st.secrets.get("TOKEN")  # Replace with your actual token
+MAX_SEARCH_WORKERS = 8  # Concurrent Apify requests for multi-branch searches
+POI_AGGREGATE_TOP_N = 50  # Top-rated POIs still drawn as dots in the aggregated view
+MAPBOX_TOKEN = st.secrets.get("MAPBOX_TOKEN")
+
+# Basemap styles. Mapbox vector tiles are rasterized on the GPU alongside the
+# deck.gl layers; without a Mapbox token we fall back to the Carto basemaps.
+MAP_STYLES = {
+    "Light": "mapbox://styles/mapbox/light-v11",
+    "Dark": "mapbox://styles/mapbox/dark-v11",
+    "Road": "mapbox://styles/mapbox/streets-v12",
+    "Satellite": "mapbox://styles/mapbox/satellite-streets-v12"
+}
+FALLBACK_MAP_STYLES = {
+    "Light": "light",
+    "Dark": "dark",
+    "Road": "road",
+    "Satellite": "road"
+}
 
 # Common POI categories
 POI_CATEGORIES = {
@@ -41,6 +68,8 @@ POI_CATEGORIES = {
     "Government": ["government office", "municipal office"],
     "Banking": ["bank", "atm", "financial institution"]
 }
+POI_CATEGORY_PLACEHOLDER = "Select category..."
+POI_CATEGORY_OPTIONS = (POI_CATEGORY_PLACEHOLDER, *POI_CATEGORIES)
 
 # Generate distinct colors for branches
 def generate_branch_colors(branch_names):
@@ -72,7 +101,6 @@ def generate_branch_colors(branch_names):
     for branch in branch_names:
         if branch not in branch_colors:
             # Generate random colors for additional branches
-            import random
             branch_colors[branch] = [
                 random.randint(50, 200),
                 random.randint(50, 200),
@@ -88,30 +116,68 @@ def generate_branch_colors(branch_names):
     
     return branch_colors, radius_colors
 
+def get_basemap_kwargs(map_style: str = "Light") -> Dict[str, Any]:
+    """Return the pdk.Deck basemap arguments for a map style name."""
+    if MAPBOX_TOKEN:
+        return {
+            "map_provider": "mapbox",
+            "map_style": MAP_STYLES.get(map_style, MAP_STYLES["Light"]),
+            "api_keys": {"mapbox": MAPBOX_TOKEN}
+        }
+    return {"map_style": FALLBACK_MAP_STYLES.get(map_style, 'light')}
+
 # ====================
 # 3. DATA FUNCTIONS
 # ====================
+# Branch dataset as typed column arrays, built once per script run
+BRANCH_ARRAYS = {
+    "Branch": np.array(["PANATHUR", "BELLANDUR", "BELLANDUR-OUTER", "DOMLUR", "BRIGADE METROPOLIS"], dtype=object),
+    "IFSC_Code": np.array(["SBIN0017040", "SBIN0015647", "SBIN0041171", "SBIN0016877", "SBIN0015034"], dtype=object),
+    "Address": np.array([
+        "Panathur Junction, Marathahalli",
+        "Kaikondrahalli, Bellandur",
+        "Outer Ring Road, Bellandur",
+        "Complex, Domlur",
+        "Whitefield Road"
+    ], dtype=object),
+    "City": np.array(["BANGALORE"] * 5, dtype=object),
+    "State": np.array(["KARNATAKA"] * 5, dtype=object),
+    "Pincode": np.array(["560037", "560035", "560103", "560071", "560016"], dtype=object),
+    "Country": np.array(["India"] * 5, dtype=object),
+    # 5 decimal places (~1 m) is plenty at branch zoom and keeps the map payload small
+    "Latitude": np.round(np.array([12.9382107, 12.9188658, 12.9246927, 12.9534312, 12.9927608], dtype=np.float64), 5),
+    "Longitude": np.round(np.array([77.6992385, 77.6700914, 77.672937, 77.6406167, 77.7021471], dtype=np.float64), 5),
+}
+
+# Per-branch (lat, lon) and network centroid, used to center the map views
+BRANCH_COORDS = dict(zip(
+    BRANCH_ARRAYS["Branch"].tolist(),
+    zip(BRANCH_ARRAYS["Latitude"].tolist(), BRANCH_ARRAYS["Longitude"].tolist())
+))
+BRANCH_CENTROID = (
+    float(BRANCH_ARRAYS["Latitude"].mean()),
+    float(BRANCH_ARRAYS["Longitude"].mean())
+)
+BRANCH_OPTIONS = ("All Branches", *BRANCH_ARRAYS["Branch"].tolist())
+
 @st.cache_data
 def load_branch_data() -> pd.DataFrame:
-    return pd.DataFrame({
-        "Branch": ["PANATHUR", "BELLANDUR", "BELLANDUR-OUTER", "DOMLUR", "BRIGADE METROPOLIS"],
-        "IFSC_Code": ["SBIN0017040", "SBIN0015647", "SBIN0041171", "SBIN0016877", "SBIN0015034"],
-        "Address": [
-            "Panathur Junction, Marathahalli",
-            "Kaikondrahalli, Bellandur",
-            "Outer Ring Road, Bellandur",
-            "Complex, Domlur",
-            "Whitefield Road"
-        ],
-        "City": ["BANGALORE"] * 5,
-        "State": ["KARNATAKA"] * 5,
-        "Pincode": ["560037", "560035", "560103", "560071", "560016"],
-        "Country": ["India"] * 5,
-        "Latitude": [12.9382107, 12.9188658, 12.9246927, 12.9534312, 12.9927608],
-        "Longitude": [77.6992385, 77.6700914, 77.672937, 77.6406167, 77.7021471],
-    })
+    df = pd.DataFrame(BRANCH_ARRAYS, copy=False)
+    # Low-cardinality labels as categoricals; coordinates keep float64 from BRANCH_ARRAYS
+    for col in ("Branch", "City", "State", "Country"):
+        df[col] = df[col].astype("category")
+    return df
 
-def get_selected_branches_data(selected_branches: List[str]) -> pd.DataFrame:
+@st.cache_resource
+def build_branch_soa() -> Dict[str, np.ndarray]:
+    """Column arrays of the branch data, so map layers are built without pandas."""
+    return {
+        col: BRANCH_ARRAYS[col]
+        for col in ("Branch", "IFSC_Code", "Address", "Pincode", "Latitude", "Longitude")
+    }
+
+@st.cache_data
+def get_selected_branches_data(selected_branches: Tuple[str, ...]) -> pd.DataFrame:
     """Get data for selected branches."""
     data = load_branch_data()
     if "All Branches" in selected_branches:
@@ -121,10 +187,27 @@ def get_selected_branches_data(selected_branches: List[str]) -> pd.DataFrame:
 # ====================
 # 4. POI SEARCH FUNCTIONS
 # ====================
-def search_poi_apify(query: str, lat: float, lng: float, max_items: int = 50, 
-                    country: str = "IN", lang: str = "en", zoom: int = 12) -> List[Dict]:
-    """Search for POI using Apify API."""
-    
+@st.cache_resource
+def get_apify_session() -> requests.Session:
+    """Shared HTTP session so Apify connections are kept alive and reused."""
+    session = requests.Session()
+    # Each POST starts a billed actor run, so only retry requests the actor never
+    # received: connection failures and 429 rejections, not read timeouts or 5xx
+    retries = Retry(
+        total=2,
+        read=0,
+        backoff_factor=0.3,
+        status_forcelist=[429],
+        allowed_methods=frozenset({"POST"}),  # The actor endpoint is POST-only
+        raise_on_status=False  # Final error response reaches the status check below
+    )
+    session.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=retries))
+    return session
+
+@st.cache_data(ttl=3600, show_spinner=False, max_entries=256)
+def fetch_poi_apify(query: str, lat: float, lng: float, max_items: int = 50, 
+                   country: str = "IN", lang: str = "en", zoom: int = 12) -> List[Dict]:
+    """Fetch POI from the Apify API; raises requests.HTTPError on a bad status."""
     payload = {
         "query": query,
         "lat": str(lat),
@@ -134,53 +217,61 @@ def search_poi_apify(query: str, lat: float, lng: float, max_items: int = 50,
         "lang": lang,
         "zoom": zoom
     }
+    headers = {"Content-Type": "application/json"}
+    params = {"token": APIFY_TOKEN}
+    
+    response = get_apify_session().post(
+        APIFY_API_URL,
+        params=params,
+        json=payload,
+        headers=headers,
+        timeout=30
+    )
+    if response.status_code not in [200, 201]:
+        raise requests.HTTPError(
+            f"API Error: {response.status_code} - {response.text}", response=response
+        )
     
+    results = response.json()
+    # Distances for the whole batch in one vectorized pass
+    poi_lats = np.array([item.get('latitude', lat) for item in results], dtype=np.float64)
+    poi_lngs = np.array([item.get('longitude', lng) for item in results], dtype=np.float64)
+    distances = calculate_distance(lat, lng, poi_lats, poi_lngs).tolist()
+    # Add source info
+    for item, distance in zip(results, distances):
+        item['search_query'] = query
+        item['search_center_lat'] = lat
+        item['search_center_lng'] = lng
+        item['distance_km'] = distance
+    return results
+
+def report_search_error(error: Exception):
+    """Show a failed POI search in the UI."""
+    if isinstance(error, requests.HTTPError):
+        st.error(str(error))
+    else:
+        st.error(f"Error searching POI: {str(error)}")
+
+def search_poi_apify(query: str, lat: float, lng: float, max_items: int = 50, 
+                    country: str = "IN", lang: str = "en", zoom: int = 12) -> List[Dict]:
+    """Search for POI using Apify API."""
     try:
-        headers = {"Content-Type": "application/json"}
-        params = {"token": APIFY_TOKEN}
-        
         with st.spinner(f"Searching for {query} near location..."):
-            response = requests.post(
-                APIFY_API_URL,
-                params=params,
-                json=payload,
-                headers=headers,
-                timeout=30
-            )
-            
-        if response.status_code in [200, 201]:
-            results = response.json()
-            # Add source info
-            for item in results:
-                item['search_query'] = query
-                item['search_center_lat'] = lat
-                item['search_center_lng'] = lng
-                item['distance_km'] = calculate_distance(
-                    lat, lng, 
-                    item.get('latitude', lat), 
-                    item.get('longitude', lng)
-                )
-            return results
-        else:
-            st.error(f"API Error: {response.status_code} - {response.text}")
-            return []
-            
+            return fetch_poi_apify(query, lat, lng, max_items, country, lang, zoom)
     except Exception as e:
-        st.error(f"Error searching POI: {str(e)}")
+        report_search_error(e)
         return []
 
-def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    """Calculate distance between two points in kilometers."""
-    from math import radians, sin, cos, sqrt, atan2
-    
+def calculate_distance(lat1, lon1, lat2, lon2):
+    """Calculate distance between points in kilometers; works element-wise on NumPy arrays."""
     R = 6371  # Earth's radius in km
     
-    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
     dlat = lat2 - lat1
     dlon = lon2 - lon1
     
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1-a))
+    a = np.sin(dlat/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2)**2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
     
     return R * c
 
@@ -201,122 +292,196 @@ def generate_circle_polygon(lat, lon, radius_km, num_points=64):
 def search_multiple_branches_poi(selected_branches: List[str], query: str, 
                                max_items_per_branch: int = 30) -> pd.DataFrame:
     """Search POI for multiple branches and combine results."""
-    all_results = []
-    branch_data = get_selected_branches_data(selected_branches)
+    branch_data = get_selected_branches_data(tuple(selected_branches))
     
-    # Generate colors for branches
-    branch_colors, radius_colors = generate_branch_colors(branch_data['Branch'].tolist())
+    branches = list(branch_data.itertuples(index=False))
+    results_by_branch = {}
     
     progress_bar = st.progress(0)
     status_text = st.empty()
-    
-    for i, (idx, branch) in enumerate(branch_data.iterrows()):
-        status_text.text(f"Searching near {branch['Branch']}... ({i+1}/{len(branch_data)})")
-        
-        results = search_poi_apify(
-            query=query,
-            lat=branch['Latitude'],
-            lng=branch['Longitude'],
-            max_items=max_items_per_branch
-        )
-        
-        # Add branch info and color to each result
-        for result in results:
-            result['source_branch'] = branch['Branch']
-            result['source_ifsc'] = branch['IFSC_Code']
-            result['source_address'] = branch['Address']
-            result['branch_color'] = branch_colors.get(branch['Branch'], [128, 128, 128, 200])
-        
-        all_results.extend(results)
-        
-        progress_bar.progress((i + 1) / len(branch_data))
-        time.sleep(0.5)  # Rate limiting
+    status_text.text(f"Searching near {len(branches)} branches...")
+    
+    # Requests are independent HTTP calls, so run them concurrently
+    with ThreadPoolExecutor(max_workers=min(MAX_SEARCH_WORKERS, max(len(branches), 1))) as executor:
+        futures = {
+            executor.submit(
+                fetch_poi_apify,
+                query=query,
+                lat=branch.Latitude,
+                lng=branch.Longitude,
+                max_items=max_items_per_branch
+            ): branch
+            for branch in branches
+        }
+        for i, future in enumerate(as_completed(futures)):
+            branch = futures[future]
+            try:
+                results_by_branch[branch.Branch] = future.result()
+            except Exception as e:
+                report_search_error(e)
+            status_text.text(f"Searched near {branch.Branch}... ({i+1}/{len(branches)})")
+            progress_bar.progress((i + 1) / len(branches))
+    
+    # Combine in branch order: one frame per branch, with branch info assigned
+    # as whole columns rather than written into every result dict
+    branch_frames = []
+    for branch in branches:
+        results = results_by_branch.get(branch.Branch)
+        if not results:
+            continue
+        frame = pd.DataFrame.from_records(results)
+        frame['source_branch'] = branch.Branch
+        frame['source_ifsc'] = branch.IFSC_Code
+        frame['source_address'] = branch.Address
+        branch_frames.append(frame)
     
     progress_bar.empty()
     status_text.empty()
     
-    if all_results:
-        return pd.DataFrame(all_results)
+    if branch_frames:
+        return pd.concat(branch_frames, ignore_index=True)
     return pd.DataFrame()
 
 # ====================
 # 5. VISUALIZATION FUNCTIONS
 # ====================
+# Branch marker icon. We use a white/transparent PNG so that 'get_color' can tint it
+BRANCH_ICON_DATA = {
+    "url": "https://img.icons8.com/ios-filled/100/ffffff/marker.png",
+    "width": 128,
+    "height": 128,
+    "anchorY": 128, # Ensures the tip of the pin is on the coordinate
+    "mask": True    # Critical: Tells pydeck to tint the icon using get_color
+}
 
+BRANCH_TOOLTIP = {
+    "html": """
+    <div style="background: white; color: black; padding: 12px; border-radius: 6px; border-left: 4px solid #1a73e8;">
+        <b style="color: #1a73e8; font-size: 14px;">{Branch}</b><br/>
+        <b>IFSC:</b> {IFSC_Code}<br/>
+        <b>Address:</b> {Address}<br/>
+        <b>Pincode:</b> {Pincode}
+    </div>
+    """
+}
 
-def create_branch_network_map(branch_data: pd.DataFrame, selected_branch: Optional[str], 
-                             pitch: int, zoom: int, map_style: str, radius_km: float = 3) -> pdk.Deck:
-    """Create map showing branches as colored location icons with coverage circles."""
+POI_LAYER_COLUMNS = [
+    'longitude', 'latitude', 'color', 'name', 'types_display',
+    'rating_display', 'distance_display', 'source_branch'
+]
+
+POI_TOOLTIP = {
+    "html": """
+    <div style="background: white; color: black; padding: 12px; border-radius: 6px; border-left: 4px solid #e91e63;">
+        <b style="color: #e91e63;">📍 {name}</b><br/>
+        <b>Type:</b> {types_display}<br/>
+        <b>Rating:</b> {rating_display}<br/>
+        <b>Distance:</b> {distance_display}<br/>
+        <div style="margin-top:5px; font-size:11px; color:gray;">Near {source_branch}</div>
+    </div>
+    """
+}
+
+def create_coverage_layer(branch_names: List[str], lats: List[float], lons: List[float],
+                          radius_colors: Dict[str, List[int]], radius_km: float) -> "pdk.Layer":
+    """Radius circles (coverage) around each branch. Not pickable."""
+    import pydeck as pdk
+
+    radius_layer_data = []
+    for branch, lat, lon in zip(branch_names, lats, lons):
+        radius_color = radius_colors.get(branch, [128, 128, 128, 40])
+        circle_polygon = generate_circle_polygon(lat, lon, radius_km)
+        radius_layer_data.append({'polygon': circle_polygon, 'color': radius_color})
+    
+    return pdk.Layer(
+        "PolygonLayer",
+        radius_layer_data,
+        stroked=True,
+        filled=True,
+        get_polygon="polygon",
+        get_fill_color="color",
+        get_line_color=[0, 0, 0, 60],
+        get_line_width=1,
+        pickable=False, 
+    )
+
+def create_branch_icon_layer(branch_records: List[Dict], pickable: bool) -> "pdk.Layer":
+    """Colored branch map pins from records carrying position, color, icon and size."""
+    import pydeck as pdk
+
+    return pdk.Layer(
+        "IconLayer",
+        data=branch_records,
+        get_icon="icon_data",
+        get_position=['Longitude', 'Latitude'],
+        get_size="icon_size",
+        get_color='color', # Applies branch-specific RGB color
+        pickable=pickable,
+    )
+
+@st.cache_resource(max_entries=32)
+def build_branch_network_layers(selected_branch: Optional[str], radius_km: float = 3) -> list:
+    """Coverage circle and branch marker layers for the branch network map."""
     layers = []
+    soa = build_branch_soa()
     
     if selected_branch != "All Branches":
-        branch_data = branch_data[branch_data['Branch'] == selected_branch].copy()
+        mask = soa['Branch'] == selected_branch
+        soa = {col: values[mask] for col, values in soa.items()}
     
-    if branch_data.empty:
-        view_state = pdk.ViewState(latitude=12.9716, longitude=77.5946, zoom=10, pitch=pitch)
-        return pdk.Deck(layers=[], initial_view_state=view_state, map_style='light')
+    if len(soa['Branch']) == 0:
+        return layers
 
     # Generate unique colors for each branch
-    branch_colors, radius_colors = generate_branch_colors(branch_data['Branch'].tolist())
+    branch_names = soa['Branch'].tolist()
+    branch_colors, radius_colors = generate_branch_colors(branch_names)
+    lats = soa['Latitude'].tolist()
+    lons = soa['Longitude'].tolist()
     
     # 1. Radius Circles Layer (Coverage)
-    radius_layer_data = []
-    for _, branch in branch_data.iterrows():
-        radius_color = radius_colors.get(branch['Branch'], [128, 128, 128, 40])
-        circle_polygon = generate_circle_polygon(branch['Latitude'], branch['Longitude'], radius_km)
-        radius_layer_data.append({'polygon': circle_polygon, 'color': radius_color})
-    
-    if radius_layer_data:
-        layers.append(pdk.Layer(
-            "PolygonLayer",
-            radius_layer_data,
-            stroked=True,
-            filled=True,
-            get_polygon="polygon",
-            get_fill_color="color",
-            get_line_color=[0, 0, 0, 60],
-            get_line_width=1,
-            pickable=False, 
-        ))
+    layers.append(create_coverage_layer(branch_names, lats, lons, radius_colors, radius_km))
 
     # 2. Branch Icons Layer (Colored Map Pins)
-    branch_df = branch_data.copy()
-    branch_df['color'] = branch_df['Branch'].map(branch_colors)
-    
-    # Define icon properties
-    # Using a white marker icon so it can be tinted via 'mask': True
-    ICON_URL = "https://img.icons8.com/ios-filled/100/ffffff/marker.png"
-    icon_data = {
-        "url": ICON_URL,
-        "width": 128,
-        "height": 128,
-        "anchorY": 128,
-        "mask": True
-    }
-    branch_df['icon_data'] = [icon_data] * len(branch_df)
-    
+    # Only ship the fields the layer and tooltip read
     # Adjust size for selected branch to make it stand out
-    branch_df['icon_size'] = branch_df['Branch'].apply(
-        lambda x: 60 if x == selected_branch else 45
-    )
+    icon_sizes = np.where(soa['Branch'] == selected_branch, 60, 45).tolist()
+    branch_records = [
+        {
+            'Branch': branch,
+            'IFSC_Code': ifsc,
+            'Address': address,
+            'Pincode': pincode,
+            'Latitude': lat,
+            'Longitude': lon,
+            'color': branch_colors.get(branch, [128, 128, 128, 200]),
+            'icon_data': BRANCH_ICON_DATA,
+            'icon_size': size,
+        }
+        for branch, ifsc, address, pincode, lat, lon, size in zip(
+            branch_names, soa['IFSC_Code'].tolist(), soa['Address'].tolist(),
+            soa['Pincode'].tolist(), lats, lons, icon_sizes
+        )
+    ]
 
-    layers.append(pdk.Layer(
-        "IconLayer",
-        data=branch_df,
-        get_icon="icon_data",
-        get_position=['Longitude', 'Latitude'],
-        get_size="icon_size",
-        get_color='color', # Applies branch-specific RGB color
-        pickable=True,     # Keep pickable so tooltip shows branch info
-    ))
+    # Keep pickable so tooltip shows branch info
+    layers.append(create_branch_icon_layer(branch_records, pickable=True))
     
-    # 3. View State Calculation
-    if selected_branch != "All Branches" and not branch_df.empty:
-        center_lat = branch_df['Latitude'].iloc[0]
-        center_lon = branch_df['Longitude'].iloc[0]
-    else:
-        center_lat = branch_data['Latitude'].mean()
-        center_lon = branch_data['Longitude'].mean()
+    return layers
+
+@st.cache_resource(max_entries=64)
+def create_branch_network_map(selected_branch: Optional[str], pitch: int, zoom: int,
+                              map_style: str, radius_km: float = 3) -> "pdk.Deck":
+    """Create map showing branches as colored location icons with coverage circles."""
+    import pydeck as pdk
+
+    layers = build_branch_network_layers(selected_branch, radius_km)
+    
+    if not layers:
+        view_state = pdk.ViewState(latitude=12.9716, longitude=77.5946, zoom=10, pitch=pitch)
+        return pdk.Deck(layers=[], initial_view_state=view_state, **get_basemap_kwargs(map_style))
+    
+    # View State Calculation
+    center_lat, center_lon = BRANCH_COORDS.get(selected_branch, BRANCH_CENTROID)
     
     view_state = pdk.ViewState(
         latitude=center_lat,
@@ -325,94 +490,85 @@ def create_branch_network_map(branch_data: pd.DataFrame, selected_branch: Option
         pitch=pitch
     )
     
-    # 4. Tooltip (Shows branch details on hover)
-    tooltip = {
-        "html": """
-        <div style="background: white; color: black; padding: 12px; border-radius: 6px; border-left: 4px solid #1a73e8;">
-            <b style="color: #1a73e8; font-size: 14px;">{Branch}</b><br/>
-            <b>IFSC:</b> {IFSC_Code}<br/>
-            <b>Address:</b> {Address}<br/>
-            <b>Pincode:</b> {Pincode}
-        </div>
-        """
-    }
-
-    # Map style mapping
-    MAP_STYLES = {
-        "Light": "light",
-        "Dark": "dark",
-        "Road": "mapbox://styles/mapbox/streets-v11",
-        "Satellite": "mapbox://styles/mapbox/satellite-streets-v11"
-    }
-    
     return pdk.Deck(
         layers=layers,
         initial_view_state=view_state,
-        map_style=MAP_STYLES.get(map_style, 'light'),
-        tooltip=tooltip
+        tooltip=BRANCH_TOOLTIP,  # Shows branch details on hover
+        **get_basemap_kwargs(map_style)
     )
-def create_poi_map(branch_data: pd.DataFrame, poi_data: pd.DataFrame, radius_km: float = 3) -> pdk.Deck:
-    """Create map with Branches as Icons and POIs as Dots. Tooltip only for POIs."""
+def create_poi_map(branch_data: pd.DataFrame, poi_data: pd.DataFrame, radius_km: float = 3,
+                   aggregate: bool = False) -> "pdk.Deck":
+    """Create map with Branches as Icons and POIs as Dots, or hexagon bins when aggregated."""
+    import pydeck as pdk
+
     layers = []
     
     # Generate colors
-    branch_colors, radius_colors = generate_branch_colors(branch_data['Branch'].tolist())
+    branch_names = branch_data['Branch'].tolist()
+    branch_colors, radius_colors = generate_branch_colors(branch_names)
     
-    # 1. Radius Circles (Not pickable)
-    radius_layer_data = []
-    for _, branch in branch_data.iterrows():
-        radius_color = radius_colors.get(branch['Branch'], [128, 128, 128, 40])
-        circle_polygon = generate_circle_polygon(branch['Latitude'], branch['Longitude'], radius_km)
-        radius_layer_data.append({'polygon': circle_polygon, 'color': radius_color})
-    
-    if radius_layer_data:
-        layers.append(pdk.Layer(
-            "PolygonLayer", radius_layer_data, stroked=True, filled=True,
-            get_polygon="polygon", get_fill_color="color", get_line_color=[0, 0, 0, 60],
-            get_line_width=1, pickable=False
-        ))
-
-    
-    if not branch_data.empty:
-        branch_df = branch_data.copy()
+    if branch_names:
+        lats = branch_data['Latitude'].tolist()
+        lons = branch_data['Longitude'].tolist()
         
-        # Ensure we have the RGB arrays from your branch_colors mapping
-        branch_df['color'] = branch_df['Branch'].map(branch_colors)
+        # 1. Radius Circles (Not pickable)
+        layers.append(create_coverage_layer(branch_names, lats, lons, radius_colors, radius_km))
         
-        # We use a white/transparent PNG so that 'get_color' can tint it correctly
-        ICON_URL = "https://img.icons8.com/ios-filled/100/ffffff/marker.png"
-        
-        icon_data = {
-            "url": ICON_URL,
-            "width": 128,
-            "height": 128,
-            "anchorY": 128, # Ensures the tip of the pin is on the coordinate
-            "mask": True    # Critical: Tells pydeck to tint the icon using get_color
-        }
-        branch_df['icon_data'] = [icon_data] * len(branch_df)
-
-        layers.append(pdk.Layer(
-            "IconLayer",
-            data=branch_df,
-            get_icon="icon_data",
-            get_position=['Longitude', 'Latitude'],
-            get_size=45,
-            get_color='color',  # Matches the [R, G, B, A] from your branch_colors
-            pickable=False      # Keeps the focus on POI tooltips
-        ))    
+        # 2. Branch Icons (not pickable, keeps the focus on POI tooltips)
+        branch_records = [
+            {
+                'Latitude': lat,
+                'Longitude': lon,
+                'color': branch_colors.get(branch, [128, 128, 128, 200]),
+                'icon_data': BRANCH_ICON_DATA,
+                'icon_size': 45,
+            }
+            for branch, lat, lon in zip(branch_names, lats, lons)
+        ]
+        layers.append(create_branch_icon_layer(branch_records, pickable=False))
+    
     # 3. POI Layer (Dots with tooltips)
     if not poi_data.empty:
         poi_df = poi_data.copy()
         
-        # Formatting for tooltips
-        poi_df['rating_display'] = poi_df.apply(lambda r: f"{r.get('rating')}/5" if pd.notnull(r.get('rating')) else "Not rated", axis=1)
-        poi_df['distance_display'] = poi_df.apply(lambda r: f"{float(r.get('distance_km', 0)):.1f} km", axis=1)
+        # Formatting for tooltips (one decimal, so float32 values don't show as 4.300000190734863)
+        if 'rating' in poi_df.columns:
+            poi_df['rating_display'] = poi_df['rating'].map('{:.1f}/5'.format).where(poi_df['rating'].notna(), "Not rated")
+        else:
+            poi_df['rating_display'] = "Not rated"
+        poi_df['distance_display'] = poi_df['distance_km'].map('{:.1f} km'.format) if 'distance_km' in poi_df.columns else "0.0 km"
         poi_df['types_display'] = poi_df['types'].apply(lambda x: ', '.join(x) if isinstance(x, list) else str(x))
-        poi_df['color'] = poi_df['source_branch'].apply(lambda x: branch_colors.get(x, [128, 128, 128, 180]))
+        # Color lookup per distinct branch, then one gather over all POIs.
+        # The trailing default row is what factorize's -1 (missing) code indexes.
+        branch_codes, branch_uniques = pd.factorize(poi_df['source_branch'])
+        color_lut = np.array(
+            [branch_colors.get(b, [128, 128, 128, 180]) for b in branch_uniques] + [[128, 128, 128, 180]],
+            dtype=np.uint8
+        )
+        poi_df['color'] = color_lut[branch_codes].tolist()
 
+        if aggregate:
+            # GPU-side binning; not pickable, as the POI tooltip has no per-bin fields
+            layers.append(pdk.Layer(
+                "HexagonLayer",
+                data=poi_df[['longitude', 'latitude']],
+                get_position=['longitude', 'latitude'],
+                radius=200,
+                elevation_scale=4,
+                extruded=True,
+                pickable=False
+            ))
+            if 'rating' in poi_df.columns:
+                poi_df = poi_df.nlargest(POI_AGGREGATE_TOP_N, 'rating')
+            else:
+                poi_df = poi_df.head(POI_AGGREGATE_TOP_N)
+
+        # Send only what the layer and its tooltip read; the raw float32 columns would
+        # serialize with their full binary expansion
+        layer_cols = [col for col in POI_LAYER_COLUMNS if col in poi_df.columns]
         layers.append(pdk.Layer(
             "ScatterplotLayer",
-            data=poi_df,
+            data=poi_df[layer_cols],
             get_position=['longitude', 'latitude'],
             get_radius=100,
             get_fill_color='color',
@@ -430,109 +586,120 @@ def create_poi_map(branch_data: pd.DataFrame, poi_data: pd.DataFrame, radius_km:
         
     view_state = pdk.ViewState(latitude=center_lat, longitude=center_lon, zoom=12, pitch=40)
     
-    # 5. Tooltip (Now only triggers for pickable layers, i.e., POIs)
-    tooltip = {
-        "html": """
-        <div style="background: white; color: black; padding: 12px; border-radius: 6px; border-left: 4px solid #e91e63;">
-            <b style="color: #e91e63;">📍 {name}</b><br/>
-            <b>Type:</b> {types_display}<br/>
-            <b>Rating:</b> {rating_display}<br/>
-            <b>Distance:</b> {distance_display}<br/>
-            <div style="margin-top:5px; font-size:11px; color:gray;">Near {source_branch}</div>
-        </div>
-        """
-    }
-    
-    return pdk.Deck(layers=layers, initial_view_state=view_state, map_style='light', tooltip=tooltip)
+    # Tooltip only triggers for pickable layers, i.e., POIs
+    return pdk.Deck(layers=layers, initial_view_state=view_state, tooltip=POI_TOOLTIP, **get_basemap_kwargs("Light"))
+
+def _parse_types(val):
+    """Normalize a POI 'types' value to a list."""
+    if isinstance(val, list):
+        return val
+    elif isinstance(val, str):
+        try:
+            # Handle string representation of list
+            parsed = ast.literal_eval(val)
+        except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+            return [val]
+        return parsed if isinstance(parsed, list) else [val]
+    return []
+
+POI_KEEP_COLUMNS = {
+    'name', 'full_address', 'rating', 'review_count', 'distance_km', 'types',
+    'phone_number', 'website', 'place_link', 'latitude', 'longitude',
+    'source_branch', 'source_ifsc', 'source_address',
+    'search_query', 'search_center_lat', 'search_center_lng'
+}
 
 def clean_poi_data(df: pd.DataFrame) -> pd.DataFrame:
     """Clean and validate POI data from Apify API."""
     if df.empty:
         return df
     
-    df_clean = df.copy()
+    # Keep only the fields the app uses; Apify rows carry many bulky extras
+    df_clean = df[[col for col in df.columns if col in POI_KEEP_COLUMNS]].copy()
     if 'rating' in df_clean.columns:
-        df_clean['rating'] = pd.to_numeric(df_clean['rating'], errors='coerce')
+        df_clean['rating'] = pd.to_numeric(df_clean['rating'], errors='coerce').astype('float32')
+    
+    # Round coordinates to 5 decimal places (~1 m) to shrink the map payload
+    for col in ('latitude', 'longitude'):
+        if col in df_clean.columns:
+            df_clean[col] = pd.to_numeric(df_clean[col], errors='coerce').round(5)
     
     # Ensure distance_km is numeric
     if 'distance_km' in df_clean.columns:
-        df_clean['distance_km'] = pd.to_numeric(df_clean['distance_km'], errors='coerce')
+        df_clean['distance_km'] = pd.to_numeric(df_clean['distance_km'], errors='coerce').astype('float32')
 
     if 'review_count' in df_clean.columns:
-        df_clean['review_count'] = pd.to_numeric(df_clean['review_count'], errors='coerce').fillna(0)
+        df_clean['review_count'] = pd.to_numeric(df_clean['review_count'], errors='coerce').fillna(0).round().astype('Int32')
     
     # Convert any string representations of lists to actual lists for 'types'
     if 'types' in df_clean.columns:
-        def parse_types(val):
-            if isinstance(val, list):
-                return val
-            elif isinstance(val, str):
-                try:
-                    import ast
-                    return ast.literal_eval(val)
-                except:
-                    return [val]
-            return []
-        
-        df_clean['types'] = df_clean['types'].apply(parse_types)
+        df_clean['types'] = df_clean['types'].apply(_parse_types)
     
     return df_clean
-    
-    if df.empty:
-        return df
-    
-    df_clean = df.copy()
-    
-    # Ensure critical columns exist with safe defaults
-    required_columns = {
-        'source_branch': 'Unknown Branch',
-        'distance_km': 0.0,
-        'rating': 'N/A',
-        'review_count': 0,
-        'full_address': 'Address not available',
-        'name': 'Unnamed POI'
-    }
-    
-    for col, default_val in required_columns.items():
-        if col not in df_clean.columns:
-            df_clean[col] = default_val
-        else:
-            # Fill NaN values for existing columns
-            df_clean[col] = df_clean[col].fillna(default_val)
 
+CHART_TEXT_COLOR = "#03045e"  # Dark navy for high contrast
+
+@st.cache_resource(max_entries=32)
+def build_poi_type_pie(top_types: Tuple[Tuple[str, int], ...]) -> "go.Figure":
+    """Build the Top 10 POI Types pie from (type, count) pairs."""
+    import plotly.express as px
+
+    fig = px.pie(
+        values=[count for _, count in top_types],
+        names=[name for name, _ in top_types],
+        title="<b>Top 10 POI Types</b>",
+        hole=0.4,
+        template='plotly_white' # Forces white-base theme
+    )
     
-    # Ensure rating is numeric
-    if 'rating' in df_clean.columns:
-        df_clean['rating'] = pd.to_numeric(df_clean['rating'], errors='coerce')
-    
-    # Ensure distance_km is numeric
-    if 'distance_km' in df_clean.columns:
-        df_clean['distance_km'] = pd.to_numeric(df_clean['distance_km'], errors='coerce')
-    
-    # Convert any string representations of lists to actual lists for 'types'
-    if 'types' in df_clean.columns:
-        def parse_types(val):
-            if isinstance(val, list):
-                return val
-            elif isinstance(val, str):
-                try:
-                    # Handle string representation of list
-                    import ast
-                    return ast.literal_eval(val)
-                except:
-                    return [val]
-            return []
-        
-        df_clean['types'] = df_clean['types'].apply(parse_types)
+    fig.update_layout(
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)',
+        font=dict(color=CHART_TEXT_COLOR, size=12),
+        title_font=dict(color=CHART_TEXT_COLOR, size=16),
+        showlegend=True,
+        legend=dict(font=dict(color=CHART_TEXT_COLOR))
+    )
+    return fig
+
+@st.cache_resource(max_entries=32)
+def build_rating_histogram(ratings: Tuple[float, ...]) -> "go.Figure":
+    """Build the rating distribution histogram."""
+    import plotly.express as px
+
+    fig = px.histogram(
+        x=list(ratings),
+        nbins=10,
+        title="<b>Rating Distribution</b>",
+        template='plotly_white'
+    )
     
-    return df_clean
+    fig.update_layout(
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)',
+        font=dict(color=CHART_TEXT_COLOR),
+        title_font=dict(color=CHART_TEXT_COLOR, size=16),
+        xaxis=dict(
+            title="Star Rating", 
+            title_font=dict(color=CHART_TEXT_COLOR),
+            tickfont=dict(color=CHART_TEXT_COLOR),
+            gridcolor='#eeeeee'
+        ),
+        yaxis=dict(
+            title="Count", 
+            title_font=dict(color=CHART_TEXT_COLOR),
+            tickfont=dict(color=CHART_TEXT_COLOR),
+            gridcolor='#eeeeee'
+        )
+    )
+    return fig
+
 def create_poi_analysis_chart(poi_data: pd.DataFrame):
     """Create analysis charts with high-contrast text for white backgrounds."""
     if poi_data.empty:
         return
     
     col1, col2 = st.columns(2)
-    TEXT_COLOR = "#03045e"  # Dark navy for high contrast
     
     with col1:
         if 'types' in poi_data.columns:
@@ -541,85 +708,85 @@ def create_poi_analysis_chart(poi_data: pd.DataFrame):
                 all_types.extend(type_list if isinstance(type_list, list) else [str(type_list)])
             
             if all_types:
-                from collections import Counter
-                type_counts = Counter(all_types)
-                top_types = dict(type_counts.most_common(10))
-                
-                fig1 = px.pie(
-                    values=list(top_types.values()),
-                    names=list(top_types.keys()),
-                    title="<b>Top 10 POI Types</b>",
-                    hole=0.4,
-                    template='plotly_white' # Forces white-base theme
-                )
-                
-                fig1.update_layout(
-                    paper_bgcolor='rgba(0,0,0,0)',
-                    plot_bgcolor='rgba(0,0,0,0)',
-                    font=dict(color=TEXT_COLOR, size=12),
-                    title_font=dict(color=TEXT_COLOR, size=16),
-                    showlegend=True,
-                    legend=dict(font=dict(color=TEXT_COLOR))
-                )
-                st.plotly_chart(fig1, use_container_width=True)
+                top_types = tuple(Counter(all_types).most_common(10))
+                st.plotly_chart(build_poi_type_pie(top_types), use_container_width=True)
 
     with col2:
         if 'rating' in poi_data.columns:
-            plot_df = poi_data.dropna(subset=['rating']).copy()
-            plot_df['rating'] = pd.to_numeric(plot_df['rating'], errors='coerce')
+            # Widen the float32 ratings so the chart sees 4.1, not 4.099999904632568
+            ratings = pd.to_numeric(poi_data['rating'], errors='coerce').dropna().astype('float64').round(6)
             
-            if not plot_df.empty:
-                fig2 = px.histogram(
-                    plot_df,
-                    x='rating',
-                    nbins=10,
-                    title="<b>Rating Distribution</b>",
-                    template='plotly_white'
-                )
-                
-                fig2.update_layout(
-                    paper_bgcolor='rgba(0,0,0,0)',
-                    plot_bgcolor='rgba(0,0,0,0)',
-                    font=dict(color=TEXT_COLOR),
-                    title_font=dict(color=TEXT_COLOR, size=16),
-                    xaxis=dict(
-                        title="Star Rating", 
-                        title_font=dict(color=TEXT_COLOR),
-                        tickfont=dict(color=TEXT_COLOR),
-                        gridcolor='#eeeeee'
-                    ),
-                    yaxis=dict(
-                        title="Count", 
-                        title_font=dict(color=TEXT_COLOR),
-                        tickfont=dict(color=TEXT_COLOR),
-                        gridcolor='#eeeeee'
-                    )
-                )
-                st.plotly_chart(fig2, use_container_width=True)
+            if not ratings.empty:
+                st.plotly_chart(build_rating_histogram(tuple(ratings.tolist())), use_container_width=True)
 # ====================
 # 6. EXPORT FUNCTIONS
 # ====================
+def write_csv(df: pd.DataFrame, sink):
+    """Write df as UTF-8 CSV to sink with pyarrow, falling back to pandas."""
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+
+    object_cols = df.select_dtypes(include='object').columns
+    text_df = df.assign(**{
+        col: df[col].map(lambda v: str(v) if isinstance(v, (list, dict)) else v)
+        for col in object_cols
+    })
+    try:
+        table = pa.Table.from_pandas(text_df, preserve_index=False)
+        output = pa.BufferOutputStream()
+        pa_csv.write_csv(table, output)
+    except pa.ArrowException:
+        df.to_csv(sink, index=False, encoding='utf-8')
+        return
+    sink.write(output.getvalue().to_pybytes())
+
 def export_data(df: pd.DataFrame, format: str = 'csv'):
     """Export data in specified format."""
     if df.empty:
         return None
     
     if format == 'csv':
-        return df.to_csv(index=False).encode('utf-8')
+        output = io.BytesIO()
+        write_csv(df, output)
+        return output.getvalue()
+    elif format == 'csv_gz':
+        # Stream the CSV through gzip; much smaller over the wire
+        output = io.BytesIO()
+        with gzip.GzipFile(fileobj=output, mode='wb', compresslevel=3) as gz:
+            write_csv(df, gz)
+        return output.getvalue()
     elif format == 'json':
-        return df.to_json(orient='records', indent=2).encode('utf-8')
+        # float32 columns would otherwise print their full binary expansion
+        return df.to_json(orient='records', indent=2, double_precision=6).encode('utf-8')
     elif format == 'excel':
         output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='POI_Data')
+        # Excel stores doubles, so widen float32 columns and round off the binary
+        # expansion (4.1 would otherwise land as 4.099999904632568)
+        float32_cols = df.select_dtypes(include='float32').columns
+        excel_df = df.assign(**{col: df[col].astype('float64').round(6) for col in float32_cols})
+        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+            excel_df.to_excel(writer, index=False, sheet_name='POI_Data')
         return output.getvalue()
     return None
 
+@st.cache_data(show_spinner=False, max_entries=32)
+def cached_export(export_key: Tuple, format: str, _df: pd.DataFrame):
+    """export_data cached on (results hash, filter thresholds); the frame itself isn't hashed."""
+    return export_data(_df, format)
+
 # ====================
 # 7. MODERN UI STYLING
 # ====================
-def inject_modern_ui():
-    st.markdown("""
+HEADER_HTML = """
+    <div class="top-header">
+        <h1> SBI Network Dashboard</h1>
+        <p style="color: var(--french-blue); font-size: 1.1rem; margin-top: 0.5rem;">
+            Branch Network & POI Intelligence Platform
+        </p>
+    </div>
+"""
+
+MODERN_UI_CSS = """
     <style>
     /* GOOGLE FONT — clean + visible */
     @import url('https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;500;600;700&display=swap');
@@ -798,6 +965,28 @@ def inject_modern_ui():
         box-shadow: 0 8px 20px rgba(0,0,0,0.15);
         transition: 0.4s ease;
     }
+    /* Native st.metric styled to match the metric cards */
+    [data-testid="stMetric"] {
+        padding: 22px;
+        border-radius: 18px;
+        background: linear-gradient(135deg, var(--bright-teal-blue), var(--sky-aqua));
+        text-align: center;
+        box-shadow: 0 8px 20px rgba(0,0,0,0.15);
+    }
+    [data-testid="stMetricLabel"], [data-testid="stMetricValue"] {
+        color: white !important;
+        justify-content: center;
+    }
+    [data-testid="stMetricLabel"] p {
+        font-size: 1rem !important;
+        font-weight: 500 !important;
+        text-transform: uppercase;
+        letter-spacing: 1px;
+    }
+    [data-testid="stMetricValue"] {
+        font-size: 2.2rem !important;
+        font-weight: 700 !important;
+    }
     .metric-card:hover {
         transform: translateY(-6px);
         box-shadow: 0 15px 30px rgba(0,0,0,0.25);
@@ -811,6 +1000,13 @@ def inject_modern_ui():
         font-size: 2rem;
         font-weight: 700;
     }
+    .metric-row {
+        display: flex;
+        gap: 1rem;
+    }
+    .metric-row .metric-card {
+        flex: 1;
+    }
 
     /* TABS */
     .stTabs [data-baseweb="tab-list"] {
@@ -933,7 +1129,10 @@ def inject_modern_ui():
         width: 100%;
     }
     </style>
-    """, unsafe_allow_html=True)
+    """
+
+def inject_modern_ui():
+    st.markdown(MODERN_UI_CSS, unsafe_allow_html=True)
 
 # ====================
 # 8. METRIC CARDS
@@ -941,20 +1140,8 @@ def inject_modern_ui():
 def render_metrics(df):
     # Only keeping real dynamic metrics
     c1, c2 = st.columns(2)
-    with c1:
-        st.markdown(f"""
-        <div class="metric-card">
-            <div class="metric-label">Total Active Branches</div>
-            <div class="metric-value">{len(df)}</div>
-        </div>
-        """, unsafe_allow_html=True)
-    with c2:
-        st.markdown(f"""
-        <div class="metric-card">
-            <div class="metric-label">Districts Covered</div>
-            <div class="metric-value">{df['City'].nunique()}</div>
-        </div>
-        """, unsafe_allow_html=True)
+    c1.metric("Total Active Branches", len(df))
+    c2.metric("Districts Covered", df['City'].nunique())
         
 def create_branch_color_legend(branches, branch_colors, radius_colors):
     """Create HTML for branch color legend."""
@@ -992,6 +1179,204 @@ def create_branch_color_legend(branches, branch_colors, radius_colors):
 # ====================
 # 9. MAIN APPLICATION
 # ====================
+def clear_poi_results():
+    """Button callback: reset POI results in session state."""
+    st.session_state.poi_results = pd.DataFrame()
+    st.session_state.pop('poi_results_hash', None)
+    st.session_state.pop('poi_filter_index', None)
+    st.session_state.pop('poi_results_timestamp', None)
+
+def results_fingerprint(df: pd.DataFrame) -> int:
+    """Content hash of a results frame. Object columns can hold lists, so they are hashed as text."""
+    object_cols = df.select_dtypes(include='object').columns
+    hashable = df.astype({col: str for col in object_cols})
+    return int(pd.util.hash_pandas_object(hashable, index=False).sum())
+
+def build_filter_index(df: pd.DataFrame) -> Dict[str, Tuple[np.ndarray, np.ndarray, int]]:
+    """Presort rating/distance once per result set: (sorted values, row positions, non-NaN count)."""
+    filter_index = {}
+    for col in ('rating', 'distance_km'):
+        if col in df.columns:
+            values = df[col].to_numpy(dtype=np.float32, na_value=np.nan)
+            order = np.argsort(values, kind='stable')
+            sorted_values = values[order]
+            filter_index[col] = (sorted_values, order, int(np.count_nonzero(~np.isnan(sorted_values))))
+    return filter_index
+
+def store_poi_results(df_results: pd.DataFrame, history_entry: Dict[str, Any]):
+    """Log the search and save its results, unless they match what is already shown."""
+    st.session_state.search_history.append(history_entry)
+    
+    if df_results.empty:
+        st.toast("No POIs found for this search")
+        st.session_state.pop('poi_results_hash', None)
+    else:
+        new_hash = results_fingerprint(df_results)
+        if new_hash == st.session_state.get('poi_results_hash'):
+            st.toast("No changes: results match the current search")
+            return
+        st.session_state.poi_results_hash = new_hash
+    
+    st.session_state.poi_results = df_results
+    st.session_state.poi_filter_index = build_filter_index(df_results)
+    # Export filenames are stamped once per result set, not on every rerun
+    st.session_state.poi_results_timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+
+@st.fragment
+def render_branch_map_section():
+    """Map controls and branch network map."""
+    # Map controls
+    col1, col2, col3, col4, col5 = st.columns(5)
+    with col1:
+        # Branch selection for main map
+        selected_branch = st.selectbox(
+            "Focus Branch", BRANCH_OPTIONS
+        )
+    with col2:
+        map_view = st.selectbox("Map Style", ["Light", "Dark", "Road", "Satellite"])
+    with col3:
+        pitch = st.slider("3D Tilt", 0, 60, 40)
+    with col4:
+        zoom = st.slider("Zoom Level", 5, 20, 11)
+    with col5:
+        branch_radius = st.slider("Branch Radius (km)", 1, 10, 3, key="branch_radius")
+    
+    st.markdown(f"###  Branch Network Map ({branch_radius}km Coverage)")
+    
+    # Map with radius circles
+    branch_map = create_branch_network_map(
+        selected_branch, 
+        pitch, 
+        zoom, 
+        map_view,
+        branch_radius
+    )
+    st.pydeck_chart(branch_map, use_container_width=True)
+
+def render_branch_table(df):
+    """Branch details table, collapsed by default so map interactions don't redraw it."""
+    with st.expander(" Branch Details", expanded=False):
+        st.dataframe(df, use_container_width=True)
+
+POI_DETAIL_COLUMNS = [
+    'name', 'full_address', 'rating', 'review_count', 'phone_number',
+    'website', 'types', 'distance_km', 'source_branch', 'place_link'
+]
+
+POI_DETAIL_COLUMN_CONFIG = {
+    'name': st.column_config.TextColumn("Name"),
+    'full_address': st.column_config.TextColumn("Address"),
+    'rating': st.column_config.NumberColumn("Rating", format="%.1f/5"),
+    'review_count': st.column_config.NumberColumn("Reviews", format="%d"),
+    'phone_number': st.column_config.TextColumn("Phone"),
+    'website': st.column_config.LinkColumn("Website"),
+    'types': st.column_config.ListColumn("Categories"),
+    'distance_km': st.column_config.NumberColumn("Distance", format="%.1f km"),
+    'source_branch': st.column_config.TextColumn("Nearest Branch"),
+    'place_link': st.column_config.LinkColumn("Map", display_text="Open in Google Maps"),
+}
+
+@st.fragment
+def render_poi_results_section():
+    """Result filters, table, exports and POI details."""
+    poi_results = st.session_state.poi_results
+    
+    # Results table
+    st.markdown("###  POI Results Table")
+
+    # Filter options: slice the presorted positions, then keep rows in original order
+    filter_index = st.session_state.get('poi_filter_index') or build_filter_index(poi_results)
+    keep = np.arange(len(poi_results))
+    min_rating = max_distance = None
+    col1, col2 = st.columns(2)
+    with col1:
+        if 'rating' in filter_index:
+            min_rating = st.slider("Minimum Rating", 0.0, 5.0, 0.0, 0.1, key="min_rating_poi")
+            values, order, valid = filter_index['rating']
+            lo = np.searchsorted(values[:valid], np.float32(min_rating), side='left')
+            keep = np.intersect1d(keep, order[lo:valid], assume_unique=True)
+
+    with col2:
+        if 'distance_km' in filter_index:
+            max_distance = st.slider("Max Distance (km)", 0.0, 20.0, 10.0, 0.1, key="max_distance_poi")
+            values, order, valid = filter_index['distance_km']
+            hi = np.searchsorted(values[:valid], np.float32(max_distance), side='right')
+            keep = np.intersect1d(keep, order[:hi], assume_unique=True)
+    
+    filtered_results = poi_results.iloc[keep]
+    results_hash = st.session_state.get('poi_results_hash') or results_fingerprint(poi_results)
+    export_key = (results_hash, min_rating, max_distance)
+
+    # Display table
+    display_cols = ['name', 'full_address', 'rating', 'distance_km', 'types', 'source_branch']
+    available_cols = [col for col in display_cols if col in filtered_results.columns]
+
+    st.dataframe(
+        filtered_results[available_cols],
+        use_container_width=True,
+        height=400
+    )
+
+    # Export options
+    st.markdown("###  Export Options")
+    export_ts = st.session_state.get('poi_results_timestamp') or datetime.now().strftime('%Y%m%d_%H%M%S')
+    col1, col2, col3, col4 = st.columns(4)
+
+    with col1:
+        csv_data = cached_export(export_key, 'csv', filtered_results)
+        if csv_data:
+            st.download_button(
+                label=" Download CSV",
+                data=csv_data,
+                file_name=f"poi_results_{export_ts}.csv",
+                mime="text/csv"
+            )
+
+        csv_gz_data = cached_export(export_key, 'csv_gz', filtered_results)
+        if csv_gz_data:
+            st.download_button(
+                label=" Download CSV (gzip)",
+                data=csv_gz_data,
+                file_name=f"poi_results_{export_ts}.csv.gz",
+                mime="application/gzip"
+            )
+
+    with col2:
+        json_data = cached_export(export_key, 'json', filtered_results)
+        if json_data:
+            st.download_button(
+                label=" Download JSON",
+                data=json_data,
+                file_name=f"poi_results_{export_ts}.json",
+                mime="application/json"
+            )
+
+    with col3:
+        excel_data = cached_export(export_key, 'excel', filtered_results)
+        if excel_data:
+            st.download_button(
+                label=" Download Excel",
+                data=excel_data,
+                file_name=f"poi_results_{export_ts}.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
+
+    with col4:
+        if st.button(" Copy to Clipboard", key="copy_clipboard_poi"):
+            json_str = filtered_results.head(10).to_json(orient='records', indent=2, double_precision=6)
+            st.code(json_str, language='json')
+            st.success("First 10 results copied to code block above")
+
+    # Individual POI cards view
+    st.markdown("###  POI Details")
+    detail_cols = [col for col in POI_DETAIL_COLUMNS if col in filtered_results.columns]
+    st.dataframe(
+        filtered_results.head(20)[detail_cols],
+        column_config=POI_DETAIL_COLUMN_CONFIG,
+        hide_index=True,
+        use_container_width=True
+    )
+
 def main():
     # Inject CSS
     inject_modern_ui()
@@ -1008,86 +1393,68 @@ def main():
     # ===== SIDEBAR =====
     st.sidebar.title(" Navigation")
     
-    # Branch selection for main map
-    selected_branch = st.sidebar.selectbox(
-        "Focus Branch", ["All Branches"] + list(data["Branch"])
-    )
-    
-    # Map controls
-    st.sidebar.markdown("###  Map Controls")
-    map_view = st.sidebar.selectbox("Map Style", ["Light", "Dark", "Road", "Satellite"])
-    pitch = st.sidebar.slider("3D Tilt", 0, 60, 40)
-    zoom = st.sidebar.slider("Zoom Level", 5, 20, 11)
-    
-    # Radius control for Branch Network tab
-    st.sidebar.markdown("###  Radius Settings")
-    branch_radius = st.sidebar.slider("Branch Radius (km)", 1, 10, 3, key="branch_radius")
-    
     # POI Search in sidebar
     st.sidebar.markdown("###  POI Search")
     
-    # Quick search category
-    quick_search = st.sidebar.selectbox(
-        "Quick Search Category",
-        ["Select category..."] + list(POI_CATEGORIES.keys())
-    )
-    
-    # Custom search
-    custom_query = st.sidebar.text_input("Custom Search Query", placeholder="e.g., coffee shops, gyms, parks")
-    
-    # Branch selection for POI search
-    st.sidebar.markdown("###  Select Branches")
-    all_branches = ["All Branches"] + list(data["Branch"])
-    selected_poi_branches = st.sidebar.multiselect(
-        "Search near these branches:",
-        all_branches,
-        default=["All Branches"]
-    )
-    
-    # POI search radius
-    poi_radius = st.sidebar.slider("POI Search Radius (km)", 1, 10, 3, key="poi_radius")
-    max_results = st.sidebar.slider("Max Results per Branch", 10, 100, 30)
-    
-    # Manual coordinates search
-    st.sidebar.markdown("###  Manual Search")
-    manual_search = st.sidebar.checkbox("Search at specific coordinates")
-    
-    manual_lat, manual_lon = None, None
-    if manual_search:
-        col1, col2 = st.sidebar.columns(2)
+    # Inputs live in a form, so edits are batched into a single rerun on submit
+    with st.sidebar.form("poi_form"):
+        # Quick search category
+        quick_search = st.selectbox(
+            "Quick Search Category",
+            POI_CATEGORY_OPTIONS
+        )
+        
+        # Custom search
+        custom_query = st.text_input("Custom Search Query", placeholder="e.g., coffee shops, gyms, parks")
+        
+        # Branch selection for POI search
+        st.markdown("###  Select Branches")
+        selected_poi_branches = st.multiselect(
+            "Search near these branches:",
+            BRANCH_OPTIONS,
+            default=["All Branches"]
+        )
+        
+        # POI search radius
+        poi_radius = st.slider("POI Search Radius (km)", 1, 10, 3, key="poi_radius")
+        max_results = st.slider("Max Results per Branch", 10, 100, 30)
+        
+        # Manual coordinates search (inputs always shown, as a form can't react to the checkbox)
+        st.markdown("###  Manual Search")
+        manual_search = st.checkbox("Search at specific coordinates")
+        col1, col2 = st.columns(2)
         with col1:
             manual_lat = st.number_input("Latitude", value=12.9716, format="%.6f")
         with col2:
             manual_lon = st.number_input("Longitude", value=77.5946, format="%.6f")
+        
+        # Search button
+        search_clicked = st.form_submit_button(
+            " Search POI",
+            type="primary",
+            use_container_width=True
+        )
     
-    # Search button
     search_query = ""
-    if quick_search != "Select category...":
+    if quick_search != POI_CATEGORY_PLACEHOLDER:
         search_query = POI_CATEGORIES[quick_search][0]
     elif custom_query:
         search_query = custom_query
     
-    search_clicked = st.sidebar.button(
-        " Search POI",
-        type="primary",
-        use_container_width=True,
-        disabled=not search_query
+    if search_clicked and not search_query:
+        st.sidebar.warning("Pick a category or enter a search query first.")
+    
+    # Map display option, outside the form so it applies immediately
+    aggregate_view = st.sidebar.toggle(
+        "Aggregate view",
+        help="Bin POIs into hexagons on the map and show only the top-rated ones as dots"
     )
     
-    # Clear results button
-    if st.sidebar.button(" Clear Results", use_container_width=True):
-        st.session_state.poi_results = pd.DataFrame()
-        st.rerun()
+    # Clear results button (the callback runs before the rerun the click triggers)
+    st.sidebar.button(" Clear Results", use_container_width=True, on_click=clear_poi_results)
     
     # ===== MAIN CONTENT =====
-    st.markdown("""
-        <div class="top-header">
-            <h1> SBI Network Dashboard</h1>
-            <p style="color: var(--french-blue); font-size: 1.1rem; margin-top: 0.5rem;">
-                Branch Network & POI Intelligence Platform
-            </p>
-        </div>
-    """, unsafe_allow_html=True)
+    st.markdown(HEADER_HTML, unsafe_allow_html=True)
     
     # Tabs for different views
     tab1, tab2, tab3 = st.tabs([" Branch Network", " POI Search Results", " POI Analysis"])
@@ -1102,24 +1469,10 @@ def main():
         legend_html = create_branch_color_legend(data['Branch'].tolist(), branch_colors, radius_colors)
         st.markdown(legend_html, unsafe_allow_html=True)
         
-        st.markdown(f"###  Branch Network Map ({branch_radius}km Coverage)")
-        
-        # Map with radius circles
-        branch_map = create_branch_network_map(
-            data, 
-            selected_branch, 
-            pitch, 
-            zoom, 
-            map_view,
-            branch_radius
-        )
-        st.pydeck_chart(branch_map, use_container_width=True)
-        
-        # Note about tooltips
+        render_branch_map_section()
         
         st.divider()
-        st.markdown("###  Branch Details")
-        st.dataframe(data, use_container_width=True)
+        render_branch_table(data)
     
     # ===== SEARCH EXECUTION =====
     if search_clicked and search_query:
@@ -1136,10 +1489,7 @@ def main():
                     df_results = pd.DataFrame(results)
                     df_results['source_branch'] = 'Manual Search'
                     df_results = clean_poi_data(df_results)
-                    st.session_state.poi_results = df_results
-                    
-                    # Add to history
-                    st.session_state.search_history.append({
+                    store_poi_results(df_results, {
                         'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                         'query': search_query,
                         'location': f"({manual_lat}, {manual_lon})",
@@ -1153,10 +1503,7 @@ def main():
                     max_items_per_branch=max_results
                 )
                 df_results = clean_poi_data(df_results)
-                st.session_state.poi_results = df_results
-                
-                # Add to history
-                st.session_state.search_history.append({
+                store_poi_results(df_results, {
                     'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                     'query': search_query,
                     'branches': selected_poi_branches,
@@ -1168,27 +1515,26 @@ def main():
     with tab2:
         if not st.session_state.poi_results.empty:
             # Results summary
-            col1, col2, col3 = st.columns(3)
-    
-    # Calculate values
             total_pois = len(st.session_state.poi_results)
     
             if 'types' in st.session_state.poi_results.columns:
-                all_types = []
-                for type_list in st.session_state.poi_results['types'].dropna():
-                    all_types.extend(type_list if isinstance(type_list, list) else [str(type_list)])
-                unique_types = len(set(all_types))
+                # Flatten the per-POI type lists in one pass; empty lists explode to NaN
+                unique_types = st.session_state.poi_results['types'].explode().dropna().astype(str).nunique()
             else:
                 unique_types = 0
         
             avg_rating = st.session_state.poi_results['rating'].mean() if 'rating' in st.session_state.poi_results.columns else 0
 
-            with col1:
-                st.markdown(f'<div class="metric-card"><div class="metric-label">Total POIs Found</div><div class="metric-value">{total_pois}</div></div>', unsafe_allow_html=True)
-            with col2:
-                st.markdown(f'<div class="metric-card"><div class="metric-label">Unique Types</div><div class="metric-value">{unique_types}</div></div>', unsafe_allow_html=True)
-            with col3:
-                st.markdown(f'<div class="metric-card"><div class="metric-label">Avg Rating</div><div class="metric-value">{avg_rating:.1f}/5</div></div>', unsafe_allow_html=True)
+            # All three cards in one flex row, sent as a single element
+            metric_cards = "".join(
+                f'<div class="metric-card"><div class="metric-label">{label}</div><div class="metric-value">{value}</div></div>'
+                for label, value in (
+                    ("Total POIs Found", total_pois),
+                    ("Unique Types", unique_types),
+                    ("Avg Rating", f"{avg_rating:.1f}/5"),
+                )
+            )
+            st.markdown(f'<div class="metric-row">{metric_cards}</div>', unsafe_allow_html=True)
             
             # Show branch color legend if we have multiple branches
             if 'source_branch' in st.session_state.poi_results.columns:
@@ -1207,107 +1553,16 @@ def main():
             # POI Map with radius circles
             st.markdown(f"###  POI Distribution Map ({poi_radius}km Radius)")
             selected_branches_data = get_selected_branches_data(
-                selected_poi_branches if not manual_search else []
+                tuple(selected_poi_branches) if not manual_search else ()
+            )
+            poi_map = create_poi_map(
+                selected_branches_data, st.session_state.poi_results, poi_radius, aggregate=aggregate_view
             )
-            poi_map = create_poi_map(selected_branches_data, st.session_state.poi_results, poi_radius)
             st.pydeck_chart(poi_map, use_container_width=True)
             
             # Note about tooltips
             
-            # Results table
-            st.markdown("###  POI Results Table")
-            
-            # Filter options
-            col1, col2 = st.columns(2)
-            with col1:
-                if 'rating' in st.session_state.poi_results.columns:
-                    min_rating = st.slider("Minimum Rating", 0.0, 5.0, 0.0, 0.1, key="min_rating_poi")
-                    filtered_results = st.session_state.poi_results[
-                        st.session_state.poi_results['rating'] >= min_rating
-                    ]
-                else:
-                    filtered_results = st.session_state.poi_results
-                    
-            with col2:
-                if 'distance_km' in st.session_state.poi_results.columns:
-                    max_distance = st.slider("Max Distance (km)", 0.0, 20.0, 10.0, 0.1, key="max_distance_poi")
-                    filtered_results = filtered_results[
-                        filtered_results['distance_km'] <= max_distance
-                    ]
-            
-            # Display table
-            display_cols = ['name', 'full_address', 'rating', 'distance_km', 'types', 'source_branch']
-            available_cols = [col for col in display_cols if col in filtered_results.columns]
-            
-            st.dataframe(
-                filtered_results[available_cols],
-                use_container_width=True,
-                height=400
-            )
-            
-            # Export options
-            st.markdown("###  Export Options")
-            col1, col2, col3, col4 = st.columns(4)
-            
-            with col1:
-                csv_data = export_data(filtered_results, 'csv')
-                if csv_data:
-                    st.download_button(
-                        label=" Download CSV",
-                        data=csv_data,
-                        file_name=f"poi_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                        mime="text/csv"
-                    )
-            
-            with col2:
-                json_data = export_data(filtered_results, 'json')
-                if json_data:
-                    st.download_button(
-                        label=" Download JSON",
-                        data=json_data,
-                        file_name=f"poi_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
-                        mime="application/json"
-                    )
-            
-            with col3:
-                excel_data = export_data(filtered_results, 'excel')
-                if excel_data:
-                    st.download_button(
-                        label=" Download Excel",
-                        data=excel_data,
-                        file_name=f"poi_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                    )
-            
-            with col4:
-                if st.button(" Copy to Clipboard", key="copy_clipboard_poi"):
-                    json_str = filtered_results.head(10).to_json(orient='records', indent=2)
-                    st.code(json_str, language='json')
-                    st.success("First 10 results copied to code block above")
-            
-            # Individual POI cards view
-            st.markdown("###  POI Details")
-            for idx, row in filtered_results.head(20).iterrows():
-                with st.expander(f" {row.get('name', 'Unknown')}"):
-                    col1, col2 = st.columns([2, 1])
-                    with col1:
-                        st.markdown(f"**Address:** {row.get('full_address', 'N/A')}")
-                        if 'rating' in row:
-                            st.markdown(f"**Rating:** {row['rating']}/5 ({row.get('review_count', 0)} reviews)")
-                        if 'phone_number' in row and pd.notna(row['phone_number']):
-                            st.markdown(f"**Phone:** {row['phone_number']}")
-                        if 'website' in row and pd.notna(row['website']):
-                            st.markdown(f"**Website:** {row['website']}")
-                        if 'types' in row:
-                            st.markdown(f"**Categories:** {row['types']}")
-                        if 'distance_km' in row:
-                            st.markdown(f"**Distance:** {row['distance_km']:.1f} km")
-                        if 'source_branch' in row:
-                            st.markdown(f"**Nearest Branch:** {row['source_branch']}")
-                    
-                    with col2:
-                        if 'place_link' in row and pd.notna(row['place_link']):
-                            st.markdown(f"[Open in Google Maps]({row['place_link']})")
+            render_poi_results_section()
             
         else:
             st.info(" Use the sidebar to search for Points of Interest near SBI branches.")